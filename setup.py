@@ -18,6 +18,7 @@ install_requires = [
     "matplotlib~=3.0",
     "networkx~=2.2",
     "numpy~=1.19",
+    "orjson~=3.4",
     "pandas~=1.2",
     "prefect[viz, gcp]~=0.14.2",
     "pyarrow~=2.0",
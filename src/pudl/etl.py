@@ -224,6 +224,7 @@ def _etl_eia(etl_params, datapkg_dir, pudl_settings, ds_kwargs):
             year_month=pc.working_partitions['eia860m']['year_month'])
         eia860_raw_dfs = pudl.extract.eia860m.append_eia860m(
             eia860_raw_dfs=eia860_raw_dfs, eia860m_raw_dfs=eia860m_raw_dfs)
+    ds.flush()
 
     # Transform EIA forms 923, 860
     eia860_transformed_dfs = pudl.transform.eia860.transform(
@@ -434,8 +435,9 @@ def _etl_epacems(etl_params, datapkg_dir, pudl_settings, ds_kwargs):
         logger.info('Not ingesting EPA CEMS.')
 
     # NOTE: This a generator for raw dataframes
+    ds = Datastore(**ds_kwargs)
     epacems_raw_dfs = pudl.extract.epacems.extract(
-        epacems_years, epacems_states, Datastore(**ds_kwargs))
+        epacems_years, epacems_states, ds)
 
     # NOTE: This is a generator for transformed dataframes
     epacems_transformed_dfs = pudl.transform.epacems.transform(
@@ -452,6 +454,7 @@ def _etl_epacems(etl_params, datapkg_dir, pudl_settings, ds_kwargs):
                                 "EPA CEMS",
                                 datapkg_dir=datapkg_dir)
         epacems_tables.append(list(transformed_df_dict.keys())[0])
+    ds.flush()
     if logger.isEnabledFor(logging.INFO):
         delta_t = time.strftime("%H:%M:%S", time.gmtime(
             time.monotonic() - start_time))
@@ -542,8 +545,10 @@ def _etl_epaipm(etl_params, datapkg_dir, pudl_settings, ds_kwargs):
     static_tables = _load_static_tables_epaipm(datapkg_dir)
 
     # Extract IPM tables
-    ds = pudl.extract.epaipm.EpaIpmDatastore(Datastore(**ds_kwargs))
+    datastore = Datastore(**ds_kwargs)
+    ds = pudl.extract.epaipm.EpaIpmDatastore(datastore)
     epaipm_raw_dfs = pudl.extract.epaipm.extract(epaipm_tables, ds)
+    datastore.flush()
 
     epaipm_transformed_dfs = pudl.transform.epaipm.transform(
         epaipm_raw_dfs, epaipm_tables
@@ -1,21 +1,27 @@
 """Datastore manages file retrieval for PUDL datasets."""
 
 import argparse
+import functools
 import hashlib
 import io
-import json
+import itertools
 import logging
 import re
+import socket
 import sys
 import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
+from types import MappingProxyType
 from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import coloredlogs
 import datapackage
+import orjson
 import requests
 import yaml
 from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
 from requests.packages.urllib3.util.retry import Retry
 
 from pudl.workspace import resource_cache
@@ -29,6 +35,17 @@ logger = logging.getLogger(__name__)
 
 
 PUDL_YML = Path.home() / ".pudl.yml"
+ZENODO_DOI_REGEX = re.compile(r"zenodo\.(\d+)")
+
+# Bounds on the size of chunks in which resources are streamed from zenodo.
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Socket options that keep idle connections to zenodo alive between requests.
+TCP_KEEPALIVE_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, "TCP_KEEPIDLE"):  # Not available on all platforms (e.g. macOS)
+    TCP_KEEPALIVE_OPTIONS.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60))
 
 
 class ChecksumMismatch(ValueError):
@@ -37,10 +54,27 @@ class ChecksumMismatch(ValueError):
     pass
 
 
+@functools.lru_cache(maxsize=None)
+def _get_datapackage_profile(profile: str) -> datapackage.Profile:
+    """Returns datapackage profile (json schema) with given name.
+
+    Loading the profile is expensive so it is done once and shared by all
+    DatapackageDescriptor instances.
+    """
+    return datapackage.Profile(profile)
+
+
 class DatapackageDescriptor:
     """A simple wrapper providing access to datapackage.json contents."""
 
-    def __init__(self, datapackage_json: dict, dataset: str, doi: str):
+    def __init__(
+        self,
+        datapackage_json: dict,
+        dataset: str,
+        doi: str,
+        validate: bool = True,
+        raw_json: Optional[bytes] = None,
+    ):
         """
         Constructs DatapackageDescriptor.
 
@@ -48,11 +82,20 @@ class DatapackageDescriptor:
           datapackage_json (dict): parsed datapackage.json describing this datapackage.
           dataset (str): name of the dataset.
           doi (str): DOI (aka version) of the dataset.
+          validate (bool): if False, skip validation of datapackage_json. This
+            should only be used for metadata that has already been validated.
+          raw_json (bytes): if provided, the serialized json that datapackage_json
+            was parsed from. It is returned by get_json_bytes() as is, which saves
+            serializing datapackage_json again.
         """
         self.datapackage_json = datapackage_json
         self.dataset = dataset
         self.doi = doi
-        self._validate_datapackage(datapackage_json)
+        self._raw_json = raw_json
+        if validate:
+            self._validate_datapackage(datapackage_json)
+        self._resources_by_name = {
+            res["name"]: res for res in datapackage_json["resources"]}
 
     def get_resource_path(self, name: str) -> str:
         """Returns zenodo url that holds contents of given named resource."""
@@ -61,25 +104,33 @@ class DatapackageDescriptor:
         # so we should be using that if it exists.
         return res.get("remote_url") or res.get("path")
 
+    def get_resource_size(self, name: str) -> Optional[int]:
+        """Returns size (in bytes) of given named resource if it is known."""
+        return self._get_resource_metadata(name).get("bytes")
+
     def _get_resource_metadata(self, name: str) -> dict:
-        for res in self.datapackage_json["resources"]:
-            if res["name"] == name:
-                return res
-        raise KeyError(f"Resource {name} not found for {self.dataset}/{self.doi}")
+        try:
+            return self._resources_by_name[name]
+        except KeyError:
+            raise KeyError(f"Resource {name} not found for {self.dataset}/{self.doi}")
 
     def validate_checksum(self, name: str, content: str) -> bool:
         """Returns True if content matches checksum for given named resource."""
-        expected_checksum = self._get_resource_metadata(name)["hash"]
         m = hashlib.md5()  # nosec
         m.update(content)
-        if m.hexdigest() != expected_checksum:
+        self.validate_digest(name, m.hexdigest())
+
+    def validate_digest(self, name: str, digest: str):
+        """Throws ChecksumMismatch if md5 hexdigest does not match the named resource."""
+        expected_checksum = self._get_resource_metadata(name)["hash"]
+        if digest != expected_checksum:
             raise ChecksumMismatch(
                 f'Checksum for resource {name} does not match.'
-                f'Expected {expected_checksum}, got {m.hexdigest()}')
+                f'Expected {expected_checksum}, got {digest}')
 
-    def _matches(self, res: dict, **filters: Any):
+    def _matches(self, res: dict, str_filters: List[Tuple[str, str]]):
         parts = res.get('parts', {})
-        return all(str(parts.get(k)) == str(v) for k, v in filters.items())
+        return all(str(parts.get(k)) == v for k, v in str_filters)
 
     def get_resources(self, name: str = None, **filters: Any) -> Iterator[PudlResourceKey]:
         """Returns series of PudlResourceKey identifiers for matching resources.
@@ -90,10 +141,15 @@ class DatapackageDescriptor:
             The constraints are matched against the 'parts' field of the resource
             entry in the datapackage.json.
         """
-        for res in self.datapackage_json["resources"]:
-            if name and res["name"] != name:
-                continue
-            if self._matches(res, **filters):
+        # Filter values are converted to strings once rather than for each resource.
+        str_filters = [(k, str(v)) for k, v in filters.items()]
+        if name:
+            res = self._resources_by_name.get(name)
+            resources = [res] if res else []
+        else:
+            resources = self._resources_by_name.values()
+        for res in resources:
+            if self._matches(res, str_filters):
                 yield PudlResourceKey(
                     dataset=self.dataset,
                     doi=self.doi,
@@ -101,16 +157,41 @@ class DatapackageDescriptor:
 
     def _validate_datapackage(self, datapackage_json: dict):
         """Checks the correctness of datapackage.json metadata. Throws ValueError if invalid."""
-        dp = datapackage.Package(datapackage_json)
-        if not dp.valid:
-            msg = f"Found {len(dp.errors)} datapackage validation errors:\n"
-            for e in dp.errors:
+        profile = _get_datapackage_profile(
+            datapackage_json.get("profile", "data-package"))
+        try:
+            profile.validate(datapackage_json)
+        except datapackage.exceptions.ValidationError as err:
+            msg = f"Found {len(err.errors)} datapackage validation errors:\n"
+            for e in err.errors:
                 msg = msg + f"  * {e}\n"
             raise ValueError(msg)
 
+    def get_json_bytes(self) -> bytes:
+        """Exports the underlying json as utf-8 bytes.
+
+        This returns the raw json this descriptor was constructed from, if given.
+        Otherwise, normalized (sorted, indented) json is produced.
+        """
+        if self._raw_json is not None:
+            return self._raw_json
+        return orjson.dumps(
+            self.datapackage_json,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2)
+
     def get_json_string(self) -> str:
-        """Exports the underlying json as normalized (sorted, indented) json string."""
-        return json.dumps(self.datapackage_json, sort_keys=True, indent=4)
+        """Exports the underlying json as string (see get_json_bytes())."""
+        return self.get_json_bytes().decode("utf-8")
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP keep-alive on the connections it opens."""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any):
+        """Initializes urllib3 PoolManager with TCP keep-alive socket options."""
+        kwargs["socket_options"] = (
+            HTTPConnection.default_socket_options + TCP_KEEPALIVE_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
 
 
 class ZenodoFetcher:
@@ -119,14 +200,16 @@ class ZenodoFetcher:
     # Zenodo tokens recorded here should have read-only access to our archives.
     # Including them here is correct in order to allow public use of this tool, so
     # long as we stick to read-only keys.
-    TOKEN = {
+    # These mappings are shared by all instances and wrapped in MappingProxyType
+    # so that they can't be accidentally modified.
+    TOKEN = MappingProxyType({
         # Read-only personal access tokens for pudl@catalyst.coop:
         "sandbox": "qyPC29wGPaflUUVAv1oGw99ytwBqwEEdwi4NuUrpwc3xUcEwbmuB4emwysco",
         "production": "KXcG5s9TqeuPh1Ukt5QYbzhCElp9LxuqAuiwdqHP0WS4qGIQiydHn6FBtdJ5"
-    }
+    })
 
-    DOI = {
-        "sandbox": {
+    DOI = MappingProxyType({
+        "sandbox": MappingProxyType({
             "censusdp1tract": "10.5072/zenodo.674992",
             "eia860": "10.5072/zenodo.672210",
             "eia860m": "10.5072/zenodo.692655",
@@ -135,8 +218,8 @@ class ZenodoFetcher:
             "epacems": "10.5072/zenodo.672963",
             "ferc1": "10.5072/zenodo.687072",
             "ferc714": "10.5072/zenodo.672224",
-        },
-        "production": {
+        }),
+        "production": MappingProxyType({
             "censusdp1tract": "10.5281/zenodo.4127049",
             "eia860": "10.5281/zenodo.4127027",
             "eia860m": "10.5281/zenodo.4281337",
@@ -145,42 +228,63 @@ class ZenodoFetcher:
             "epacems": "10.5281/zenodo.4127055",
             "ferc1": "10.5281/zenodo.4127044",
             "ferc714": "10.5281/zenodo.4127101",
-        },
-    }
-    API_ROOT = {
+        }),
+    })
+    API_ROOT = MappingProxyType({
         "sandbox": "https://sandbox.zenodo.org/api",
         "production": "https://zenodo.org/api",
-    }
+    })
 
-    def __init__(self, sandbox: bool = False, timeout: float = 15.0):
+    def __init__(
+        self,
+        sandbox: bool = False,
+        timeout: float = 15.0,
+        max_connections: int = 16,
+        cache: Optional[resource_cache.AbstractCache] = None,
+    ):
         """Constructs ZenodoFetcher instance.
 
         Args:
             sandbox (bool): controls whether production or sandbox zenodo backends
                 and associated DOIs should be used.
             timeout (float): timeout (in seconds) for http requests.
+            max_connections (int): number of keep-alive connections to zenodo that
+                will be kept open. This should match the number of threads that
+                are concurrently using this fetcher.
+            cache (AbstractCache): if provided, datapackage.json descriptors will be
+                stored in this cache and subsequently retrieved from it instead of
+                from zenodo. DOIs identify immutable versions of the datasets, so
+                the cached descriptors never need to be refreshed.
         """
         backend = "sandbox" if sandbox else "production"
         self._api_root = self.API_ROOT[backend]
         self._token = self.TOKEN[backend]
         self._dataset_to_doi = self.DOI[backend]
         self._descriptor_cache = {}  # type: Dict[str, DatapackageDescriptor]
+        self._cache = cache
 
         self.timeout = timeout
         retries = Retry(backoff_factor=2, total=3,
                         status_forcelist=[429, 500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retries)
+        # With pool_block, threads wait for a pooled connection to free up rather
+        # than opening (and handshaking) throwaway connections beyond the pool size.
+        adapter = KeepAliveHTTPAdapter(
+            max_retries=retries,
+            pool_connections=max_connections,
+            pool_maxsize=max_connections,
+            pool_block=True)
 
         self.http = requests.Session()
+        self.http.params = {"access_token": self._token}
         self.http.mount("http://", adapter)
         self.http.mount("https://", adapter)
 
-    def _fetch_from_url(self, url: str) -> requests.Response:
+    def _fetch_from_url(self, url: str, stream: bool = False) -> requests.Response:
         # logger.info(f"Retrieving {url} from zenodo")
         response = self.http.get(
             url,
-            params={"access_token": self._token},
-            timeout=self.timeout)
+            timeout=self.timeout,
+            stream=stream)
         if response.status_code == requests.codes.ok:
             # logger.info(f"Successfully downloaded {url}")
             return response
@@ -189,12 +293,10 @@ class ZenodoFetcher:
 
     def _doi_to_url(self, doi: str) -> str:
         """Returns url that holds the datapackage for given doi."""
-        match = re.search(r"zenodo.([\d]+)", doi)
+        match = ZENODO_DOI_REGEX.search(doi)
         if match is None:
             raise ValueError(f"Invalid doi {doi}")
-
-        zen_id = int(match.groups()[0])
-        return f"{self._api_root}/deposit/depositions/{zen_id}"
+        return f"{self._api_root}/deposit/depositions/{match.group(1)}"
 
     def get_descriptor(self, dataset: str) -> DatapackageDescriptor:
         """Returns DatapackageDescriptor for given dataset."""
@@ -202,18 +304,41 @@ class ZenodoFetcher:
         if not doi:
             raise KeyError(f"No doi found for dataset {dataset}")
         if doi not in self._descriptor_cache:
-            dpkg = self._fetch_from_url(self._doi_to_url(doi))
-            for f in dpkg.json()["files"]:
-                if f["filename"] == "datapackage.json":
-                    resp = self._fetch_from_url(f["links"]["download"])
-                    self._descriptor_cache[doi] = DatapackageDescriptor(
-                        resp.json(), dataset=dataset, doi=doi)
-                    break
-            else:
-                raise RuntimeError(
-                    f"Zenodo datapackage for {dataset}/{doi} does not contain valid datapackage.json")
+            self._descriptor_cache[doi] = self._load_descriptor(dataset, doi)
         return self._descriptor_cache[doi]
 
+    def _load_descriptor(self, dataset: str, doi: str) -> DatapackageDescriptor:
+        """Loads DatapackageDescriptor from the cache or, if not present, from zenodo."""
+        res = PudlResourceKey(dataset, doi, "datapackage.json")
+        cached = self._cache.try_get(res) if self._cache is not None else None
+        if cached is not None:
+            # Each doi identifies an immutable version of the dataset, so cached
+            # descriptors are used as they are, without revalidating them against
+            # zenodo. They have also been validated before they were stored.
+            return DatapackageDescriptor(
+                orjson.loads(cached),
+                dataset=dataset,
+                doi=doi,
+                validate=False,
+                raw_json=cached)
+
+        dpkg = self._fetch_from_url(self._doi_to_url(doi))
+        dp_file = next(
+            (f for f in dpkg.json()["files"] if f["filename"] == "datapackage.json"),
+            None)
+        if dp_file is None:
+            raise RuntimeError(
+                f"Zenodo datapackage for {dataset}/{doi} does not contain valid datapackage.json")
+        resp = self._fetch_from_url(dp_file["links"]["download"])
+        desc = DatapackageDescriptor(
+            orjson.loads(resp.content),
+            dataset=dataset,
+            doi=doi,
+            raw_json=resp.content)
+        if self._cache is not None:
+            self._cache.add(res, desc.get_json_bytes())
+        return desc
+
     def get_resource_key(self, dataset: str, name: str) -> PudlResourceKey:
         """Returns PudlResourceKey for given resource."""
         return PudlResourceKey(dataset, self._dataset_to_doi[dataset], name)
@@ -230,6 +355,27 @@ class ZenodoFetcher:
         desc.validate_checksum(res.name, content)
         return content
 
+    def iter_resource(self, res: PudlResourceKey) -> Iterator[bytes]:
+        """Given resource key, retrieve contents of the file from zenodo in chunks.
+
+        Chunk size is scaled with the size of the resource. The checksum of the
+        content is verified once the last chunk was retrieved and ChecksumMismatch
+        is thrown if it does not match.
+        """
+        desc = self.get_descriptor(res.dataset)
+        url = desc.get_resource_path(res.name)
+        m = hashlib.md5()  # nosec
+        with self._fetch_from_url(url, stream=True) as response:
+            size = desc.get_resource_size(res.name) or int(
+                response.headers.get("Content-Length", 0))
+            chunk_size = DEFAULT_CHUNK_SIZE
+            if size:
+                chunk_size = min(max(size // 64, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                m.update(chunk)
+                yield chunk
+        desc.validate_digest(res.name, m.hexdigest())
+
     def get_known_datasets(self) -> List[str]:
         """Returns list of supported datasets."""
         return sorted(self._dataset_to_doi)
@@ -243,7 +389,8 @@ class Datastore:
         local_cache_path: Optional[Path] = None,
         gcs_cache_path: Optional[str] = None,
         sandbox: bool = False,
-        timeout: float = 15
+        timeout: float = 15,
+        max_parallel_downloads: int = 16,
     ):
         # TODO(rousik): figure out an efficient way to configure datastore caching
         """
@@ -254,27 +401,36 @@ class Datastore:
               subdirectory of this path will be used with this Datastore.
             gcs_cache_path (str): if provided, GoogleCloudStorageCache will be used
               to retrieve data files. The path is expected to have the following
-              format: gs://bucket[/path_prefix]
+              format: gs://bucket[/path_prefix]. Writes to this cache are done in the
+              background, so callers should call flush() once they are done with the
+              datastore to wait for them and to surface any upload errors.
             sandbox (bool): if True, use sandbox zenodo backend when retrieving files,
               otherwise use production. This affects which zenodo servers are contacted
               as well as dois used for each dataset.
             timeout (floaTR): connection timeouts (in seconds) to use when connecting
               to Zenodo servers.
+            max_parallel_downloads (int): maximum number of resources that will be
+              downloaded from Zenodo concurrently.
 
         """
         self._cache = resource_cache.LayeredCache()
-        self._datapackage_descriptors = {}  # type: Dict[str, DatapackageDescriptor]
+        self._local_cache = None  # type: Optional[resource_cache.LocalFileCache]
+        self._max_parallel_downloads = max_parallel_downloads
 
         if local_cache_path:
-            self._cache.add_cache_layer(
-                resource_cache.LocalFileCache(local_cache_path))
+            self._local_cache = resource_cache.LocalFileCache(local_cache_path)
+            self._cache.add_cache_layer(self._local_cache)
         if gcs_cache_path:
+            # Uploads to GCS are slow, so they are done in the background.
             self._cache.add_cache_layer(
-                resource_cache.GoogleCloudStorageCache(gcs_cache_path))
+                resource_cache.AsyncWriteCache(
+                    resource_cache.GoogleCloudStorageCache(gcs_cache_path)))
 
         self._zenodo_fetcher = ZenodoFetcher(
             sandbox=sandbox,
-            timeout=timeout)
+            timeout=timeout,
+            max_connections=max_parallel_downloads,
+            cache=self._cache)
 
     def get_known_datasets(self) -> List[str]:
         """Returns list of supported datasets."""
@@ -282,23 +438,24 @@ class Datastore:
 
     def get_datapackage_descriptor(self, dataset: str) -> DatapackageDescriptor:
         """Fetch datapackage descriptor for given dataset either from cache or from zenodo."""
-        doi = self._zenodo_fetcher.get_doi(dataset)
-        if doi not in self._datapackage_descriptors:
-            res = PudlResourceKey(dataset, doi, "datapackage.json")
-            if self._cache.contains(res):
-                self._datapackage_descriptors[doi] = DatapackageDescriptor(
-                    json.loads(self._cache.get(res).decode('utf-8')),
-                    dataset=dataset,
-                    doi=doi)
-            else:
-                desc = self._zenodo_fetcher.get_descriptor(dataset)
-                self._datapackage_descriptors[doi] = desc
-                self._cache.add(res, bytes(desc.get_json_string(), "utf-8"))
-        return self._datapackage_descriptors[doi]
+        return self._zenodo_fetcher.get_descriptor(dataset)
+
+    def prefetch_descriptors(self, datasets: List[str]):
+        """Concurrently retrieves datapackage descriptors for given datasets.
+
+        This overlaps the zenodo round-trips needed to load the descriptors that are
+        not cached yet instead of waiting for each of them in turn.
+        """
+        with ThreadPoolExecutor(max_workers=self._max_parallel_downloads) as executor:
+            # Consuming the results propagates any exceptions thrown by the workers.
+            list(executor.map(self.get_datapackage_descriptor, datasets))
 
     def get_resources(self, dataset: str, cached_only: bool = False, **filters: Any) -> Iterator[Tuple[PudlResourceKey, bytes]]:
         """Return content of the matching resources.
 
+        Checksums of the resources retrieved from the cache are verified. Resources that
+        do not match their checksum are removed from the cache and downloaded again.
+
         Args:
             dataset (str): name of the dataset to query.
             cached_only (bool): if True, only retrieve resources that are present in the cache.
@@ -309,35 +466,138 @@ class Datastore:
             (PudlResourceKey, io.BytesIO) holding content for each matching resource
         """
         desc = self.get_datapackage_descriptor(dataset)
+        missing = []
         for res in desc.get_resources(**filters):
-            if self._cache.contains(res):
-                logger.debug(f"Retrieved {res} from cache.")
-                yield (res, self._cache.get(res))
-            elif not cached_only:
-                logger.debug(f"Retrieved {res} from zenodo.")
-                contents = self._zenodo_fetcher.get_resource(res)
-                self._cache.add(res, contents)
-                yield (res, contents)
+            contents = self._cache.try_get(res)
+            if contents is not None:
+                try:
+                    desc.validate_checksum(res.name, contents)
+                except ChecksumMismatch:
+                    logger.warning(
+                        f"Resource {res} has invalid checksum. Removing from cache.")
+                    self._cache.delete(res)
+                else:
+                    logger.debug(f"Retrieved {res} from cache.")
+                    yield (res, contents)
+                    continue
+            if not cached_only:
+                missing.append(res)
+        yield from self._download_resources(missing)
+
+    def _download_resources(self, missing: List[PudlResourceKey]) -> Iterator[Tuple[PudlResourceKey, bytes]]:
+        """Downloads given resources concurrently and yields their content.
+
+        At most max_parallel_downloads resources are being downloaded (or held in
+        memory waiting to be yielded) at any time. Resources are yielded in the
+        order in which their downloads finish so that one slow download does not
+        hold back those that are already done.
+        """
+        missing = iter(missing)
+        executor = ThreadPoolExecutor(max_workers=self._max_parallel_downloads)
+        pending = {}  # type: Dict[Future, PudlResourceKey]
+        try:
+            for res in itertools.islice(missing, self._max_parallel_downloads):
+                pending[executor.submit(self._download_resource, res)] = res
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                while done:
+                    future = done.pop()
+                    res = pending.pop(future)
+                    contents = future.result()
+                    for next_res in itertools.islice(missing, 1):
+                        pending[executor.submit(self._download_resource, next_res)] = next_res
+                    if contents is None:
+                        contents = self._local_cache.get(res)
+                    yield (res, contents)
+                    # Drop the references so that the content can be freed while
+                    # waiting for the next download.
+                    del future, contents
+        finally:
+            # If the generator is abandoned early, do not wait for the downloads
+            # that are still in progress.
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _download_resource(self, res: PudlResourceKey) -> Optional[bytes]:
+        """Retrieves resource from zenodo and stores it in the cache.
+
+        This runs on the download threads so that writing one resource into the
+        cache overlaps with the downloads of the others. When local cache is
+        available, the content is streamed directly into it and None is returned,
+        otherwise the downloaded content is returned.
+        """
+        if self._local_cache is not None:
+            desc = self.get_datapackage_descriptor(res.dataset)
+            self._cache.add_stream(
+                res,
+                self._zenodo_fetcher.iter_resource(res),
+                size_hint=desc.get_resource_size(res.name))
+            logger.debug(f"Retrieved {res} from zenodo.")
+            return None
+        contents = self._zenodo_fetcher.get_resource(res)
+        logger.debug(f"Retrieved {res} from zenodo.")
+        self._cache.add(res, contents)
+        return contents
+
+    def flush(self):
+        """Waits until all pending writes to the cache are completed."""
+        self._cache.flush()
 
     def remove_from_cache(self, res: PudlResourceKey):
         """Remove given resource from the associated cache."""
         self._cache.delete(res)
 
+    def _get_unique_resource_key(self, dataset: str, **filters: Any) -> PudlResourceKey:
+        """Returns key of a resource assuming there is exactly one that matches."""
+        desc = self.get_datapackage_descriptor(dataset)
+        resources = list(desc.get_resources(**filters))
+        if not resources:
+            raise KeyError(f"No resources found for {dataset}: {filters}")
+        if len(resources) > 1:
+            raise KeyError(f"Multiple resources found for {dataset}: {filters}")
+        return resources[0]
+
     def get_unique_resource(self, dataset: str, **filters: Any) -> bytes:
         """Returns content of a resource assuming there is exactly one that matches."""
-        res = self.get_resources(dataset, **filters)
+        res = self._get_unique_resource_key(dataset, **filters)
+        _, content = next(self.get_resources(dataset, name=res.name))
+        return content
+
+    def _has_valid_local_file(self, res: PudlResourceKey) -> bool:
+        """Returns True if resource is in the local cache and matches its checksum.
+
+        The file is hashed in chunks so that it never needs to be fully loaded into
+        memory. Cached files with invalid checksum are removed from the cache.
+        """
+        path = self._local_cache.get_path(res)
+        m = hashlib.md5()  # nosec
         try:
-            _, content = next(res)
-        except StopIteration:
-            raise KeyError(f"No resources found for {dataset}: {filters}")
+            with path.open("rb") as f:
+                for chunk in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b""):
+                    m.update(chunk)
+        except FileNotFoundError:
+            return False
+        desc = self.get_datapackage_descriptor(res.dataset)
         try:
-            next(res)
-        except StopIteration:
-            return content
-        raise KeyError(f"Multiple resources found for {dataset}: {filters}")
+            desc.validate_digest(res.name, m.hexdigest())
+        except ChecksumMismatch:
+            logger.warning(f"Resource {res} has invalid checksum. Removing from cache.")
+            self._cache.delete(res)
+            return False
+        return True
 
     def get_zipfile_resource(self, dataset: str, **filters: Any) -> zipfile.ZipFile:
-        """Retrieves unique resource and opens it as a ZipFile."""
+        """Retrieves unique resource and opens it as a ZipFile.
+
+        If the resource is present in the local cache and its checksum is valid,
+        the archive is read from the cached file as needed rather than being loaded
+        into memory.
+        """
+        if self._local_cache is not None:
+            res = self._get_unique_resource_key(dataset, **filters)
+            if self._has_valid_local_file(res):
+                return zipfile.ZipFile(self._local_cache.get_path(res))
         return zipfile.ZipFile(io.BytesIO(self.get_unique_resource(dataset, **filters)))
 
 
@@ -464,20 +724,19 @@ def main():
     if args.partition:
         logger.info(f"Only retrieving resources for partition: {args.partition}")
 
+    dstore.prefetch_descriptors(datasets)
+
     for selection in datasets:
         if args.validate:
-            descriptor = dstore.get_datapackage_descriptor(selection)
-            for res, content in dstore.get_resources(selection, cached_only=True, **args.partition):
-                try:
-                    descriptor.validate_checksum(res.name, content)
-                except ChecksumMismatch:
-                    logger.warning(
-                        f"Resource {res} has invalid checksum. Removing from cache.")
-                    dstore.remove_from_cache(res)
+            # get_resources() removes cached resources with invalid checksums.
+            for res, _ in dstore.get_resources(selection, cached_only=True, **args.partition):
+                logger.debug(f"Resource {res} has valid checksum.")
         else:
             for res, _ in dstore.get_resources(selection, **args.partition):
                 logger.info(f"Retrieved {res}.")
 
+    dstore.flush()
+
 
 if __name__ == "__main__":
     sys.exit(main())
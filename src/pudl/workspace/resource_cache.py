@@ -1,16 +1,27 @@
 """Implementations of datastore resource caches."""
 
 import logging
+import os
+import tempfile
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Any, List, NamedTuple
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
 from urllib.parse import urlparse
 
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
 from google.cloud.storage.blob import Blob
 
 logger = logging.getLogger(__name__)
 
+# The process umask can only be read by setting it, which is not thread-safe, so
+# it is read once at import time. It is used to give files created through
+# tempfile (which are always private) the same permissions as regular files.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 
 class PudlResourceKey(NamedTuple):
     """Uniquely identifies a specific resource."""
@@ -45,11 +56,34 @@ class AbstractCache(ABC):
         """Retrieves content of given resource or throws KeyError."""
         pass
 
+    def try_get(self, resource: PudlResourceKey) -> Optional[bytes]:
+        """Retrieves content of given resource or returns None if it is not present.
+
+        Caches should override this to look up the resource only once.
+        """
+        if self.contains(resource):
+            return self.get(resource)
+        return None
+
     @abstractmethod
     def add(self, resource: PudlResourceKey, content: bytes) -> None:
         """Adds resource to the cache and sets the content."""
         pass
 
+    def add_stream(
+        self,
+        resource: PudlResourceKey,
+        chunks: Iterable[bytes],
+        size_hint: Optional[int] = None,
+    ) -> None:
+        """Adds resource to the cache and sets the content from a series of chunks.
+
+        Caches that can write content incrementally should override this so that
+        the whole content never needs to be held in memory. The expected size of
+        the content (size_hint), if known, may be used to preallocate storage.
+        """
+        self.add(resource, b"".join(chunks))
+
     @abstractmethod
     def delete(self, resource: PudlResourceKey) -> None:
         """Removes the resource from cache."""
@@ -60,6 +94,10 @@ class AbstractCache(ABC):
         """Returns True if the resource is present in the cache."""
         pass
 
+    def flush(self) -> None:
+        """Waits until all pending modifications of the cache are completed."""
+        pass
+
 
 class LocalFileCache(AbstractCache):
     """Simple key-value store mapping PudlResourceKeys to ByteIO contents."""
@@ -74,7 +112,22 @@ class LocalFileCache(AbstractCache):
 
     def get(self, resource: PudlResourceKey) -> bytes:
         """Retrieves value associated with a given resource."""
-        return self._resource_path(resource).open("rb").read()
+        return self._resource_path(resource).read_bytes()
+
+    def try_get(self, resource: PudlResourceKey) -> Optional[bytes]:
+        """Retrieves value associated with a given resource or None if not present."""
+        try:
+            return self._resource_path(resource).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def get_path(self, resource: PudlResourceKey) -> Path:
+        """Returns path to the file holding the content of a given resource.
+
+        This allows reading the content directly from the file instead of loading
+        all of it into memory.
+        """
+        return self._resource_path(resource)
 
     def add(self, resource: PudlResourceKey, content: bytes):
         """Adds (or updates) resource to the cache with given value."""
@@ -83,7 +136,45 @@ class LocalFileCache(AbstractCache):
             return
         path = self._resource_path(resource)
         path.parent.mkdir(parents=True, exist_ok=True)
-        path.open("wb").write(content)
+        path.write_bytes(content)
+
+    def add_stream(
+        self,
+        resource: PudlResourceKey,
+        chunks: Iterable[bytes],
+        size_hint: Optional[int] = None,
+    ):
+        """Adds (or updates) resource to the cache, writing content chunk by chunk.
+
+        The content is written to a temporary file that is moved in place only
+        once all chunks were written, so a failed download never leaves a partial
+        file in the cache. If size_hint is given, the space for the file is
+        allocated upfront where the platform supports it, which avoids
+        fragmenting large files.
+        """
+        if self.is_read_only():
+            logger.debug(f"Read only cache: ignoring set({resource})")
+            return
+        path = self._resource_path(resource)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f".{path.name}.", delete=False)
+        try:
+            with tmp:
+                if size_hint and hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(tmp.fileno(), 0, size_hint)
+                    except OSError:
+                        pass  # Not supported by some filesystems.
+                for chunk in chunks:
+                    tmp.write(chunk)
+                # Drop any preallocated space beyond the actual content.
+                tmp.truncate()
+            os.chmod(tmp.name, 0o666 & ~_UMASK)
+            os.replace(tmp.name, path)
+        except BaseException:
+            Path(tmp.name).unlink(missing_ok=True)
+            raise
 
     def delete(self, resource: PudlResourceKey):
         """Deletes resource from the cache."""
@@ -123,6 +214,13 @@ class GoogleCloudStorageCache(AbstractCache):
         """Retrieves value associated with given resource."""
         return self._blob(resource).download_as_bytes()
 
+    def try_get(self, resource: PudlResourceKey) -> Optional[bytes]:
+        """Retrieves value associated with given resource or None if not present."""
+        try:
+            return self._blob(resource).download_as_bytes()
+        except NotFound:
+            return None
+
     def add(self, resource: PudlResourceKey, value: bytes):
         """Adds (or updates) resource to the cache with given value."""
         return self._blob(resource).upload_from_string(value)
@@ -136,6 +234,116 @@ class GoogleCloudStorageCache(AbstractCache):
         return self._blob(resource).exists()
 
 
+class AsyncWriteCache(AbstractCache):
+    """Wraps another cache and performs its add() calls in the background.
+
+    This is useful for caches with high write latency (e.g. GoogleCloudStorageCache)
+    as it allows the uploads to overlap with other work. Operations on a resource
+    that is still being written wait until the write is completed so that they
+    observe its content. Errors thrown by the background writes are raised from
+    flush().
+    """
+
+    def __init__(
+        self,
+        cache: AbstractCache,
+        max_workers: int = 8,
+        max_pending: int = 64,
+        **kwargs: Any
+    ):
+        """Constructs AsyncWriteCache.
+
+        Args:
+            cache (AbstractCache): cache to which the writes are delegated.
+            max_workers (int): number of threads performing the writes.
+            max_pending (int): maximum number of writes that may be pending at any
+              time. add() blocks when this is exceeded, which bounds the memory used
+              by the content that is waiting to be written.
+        """
+        super().__init__(**kwargs)
+        self._cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = {}  # type: Dict[PudlResourceKey, Future]
+        self._errors = []  # type: List[BaseException]
+
+    def is_read_only(self) -> bool:
+        """Returns true if this or the underlying cache is read-only."""
+        return super().is_read_only() or self._cache.is_read_only()
+
+    def _wait_for(self, resource: PudlResourceKey):
+        """Waits until pending write of the resource, if any, is completed."""
+        with self._lock:
+            future = self._pending.get(resource)
+        if future is not None:
+            wait([future])
+
+    def _write(self, resource: PudlResourceKey, value: bytes):
+        """Writes resource to the underlying cache, recording any error for flush().
+
+        Errors are recorded here rather than in a done-callback because waiting for
+        a future may return before its callbacks have been run.
+        """
+        try:
+            self._cache.add(resource, value)
+        except Exception as err:
+            logger.error(f"Writing {resource} failed: {err}")
+            with self._lock:
+                self._errors.append(err)
+
+    def _write_done(self, resource: PudlResourceKey, future: Future):
+        with self._lock:
+            if self._pending.get(resource) is future:
+                del self._pending[resource]
+        self._slots.release()
+
+    def get(self, resource: PudlResourceKey) -> bytes:
+        """Retrieves value associated with given resource."""
+        self._wait_for(resource)
+        return self._cache.get(resource)
+
+    def try_get(self, resource: PudlResourceKey) -> Optional[bytes]:
+        """Retrieves value associated with given resource or None if not present."""
+        self._wait_for(resource)
+        return self._cache.try_get(resource)
+
+    def add(self, resource: PudlResourceKey, value: bytes):
+        """Schedules the resource to be added (or updated) in the underlying cache."""
+        if self.is_read_only():
+            logger.debug(f"Read only cache: ignoring set({resource})")
+            return
+        self._slots.acquire()
+        future = self._executor.submit(self._write, resource, value)
+        with self._lock:
+            self._pending[resource] = future
+        future.add_done_callback(lambda f: self._write_done(resource, f))
+
+    def delete(self, resource: PudlResourceKey):
+        """Deletes resource from the cache."""
+        self._wait_for(resource)
+        self._cache.delete(resource)
+
+    def contains(self, resource: PudlResourceKey) -> bool:
+        """Returns True if resource is present in the cache."""
+        self._wait_for(resource)
+        return self._cache.contains(resource)
+
+    def flush(self):
+        """Waits until all pending writes are completed.
+
+        Raises the first error encountered by the background writes, if any.
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+        wait(pending)
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+        self._cache.flush()
+
+
 class LayeredCache(AbstractCache):
     """Implements multi-layered system of caches.
 
@@ -167,13 +375,21 @@ class LayeredCache(AbstractCache):
 
     def get(self, resource: PudlResourceKey) -> bytes:
         """Returns content of a given resource."""
+        content = self.try_get(resource)
+        if content is None:
+            raise KeyError(f"{resource} not found in the layered cache")
+        return content
+
+    def try_get(self, resource: PudlResourceKey) -> Optional[bytes]:
+        """Returns content of a given resource or None if it is not present."""
         for i, cache in enumerate(self._caches):
-            if cache.contains(resource):
+            content = cache.try_get(resource)
+            if content is not None:
                 logger.debug(
                     f"get:{resource} found in {i}-th layer ({cache.__class__.__name__}).")
-                return cache.get(resource)
+                return content
         logger.debug(f"get:{resource} not found in the layered cache.")
-        raise KeyError(f"{resource} not found in the layered cache")
+        return None
 
     def add(self, resource: PudlResourceKey, value):
         """Adds (or replaces) resource into the cache with given value."""
@@ -186,6 +402,22 @@ class LayeredCache(AbstractCache):
             cache_layer.add(resource, value)
             break
 
+    def add_stream(
+        self,
+        resource: PudlResourceKey,
+        chunks: Iterable[bytes],
+        size_hint: Optional[int] = None,
+    ):
+        """Adds (or replaces) resource into the cache with content given in chunks."""
+        if self.is_read_only():
+            logger.debug(f"Read only cache: ignoring set({resource})")
+            return
+        for cache_layer in self._caches:
+            if cache_layer.is_read_only():
+                continue
+            cache_layer.add_stream(resource, chunks, size_hint=size_hint)
+            break
+
     def delete(self, resource: PudlResourceKey):
         """Removes resource from the cache if the cache is not in the read_only mode."""
         if self.is_read_only():
@@ -197,6 +429,11 @@ class LayeredCache(AbstractCache):
             cache_layer.delete(resource)
             break
 
+    def flush(self):
+        """Waits until pending modifications of all cache layers are completed."""
+        for cache_layer in self._caches:
+            cache_layer.flush()
+
     def contains(self, resource: PudlResourceKey) -> bool:
         """Returns True if resource is present in the cache."""
         for i, cache in enumerate(self._caches):
@@ -1,16 +1,31 @@
 """Unit tests for Datastore module."""
 
+import hashlib
+import io
 import json
 import re
+import shutil
+import tempfile
 import unittest
+import zipfile
+from pathlib import Path
 from typing import Dict
 
 import responses
 
-from pudl.workspace import datastore
+from pudl.workspace import datastore, resource_cache
 from pudl.workspace.resource_cache import PudlResourceKey
 
 
+def make_zip(**files: bytes) -> bytes:
+    """Returns bytes of a zip archive that holds given files."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buf.getvalue()
+
+
 class TestDatapackageDescriptor(unittest.TestCase):
     """Unit tests for the DatapackageDescriptor class."""
 
@@ -67,12 +82,31 @@ class TestDatapackageDescriptor(unittest.TestCase):
             [PudlResourceKey("epacems", "123", "second-blue")],
             list(self.descriptor.get_resources(name="second-blue")))
 
+    def test_invalid_datapackage_fails_validation(self):
+        """Constructing descriptor from malformed datapackage.json throws ValueError."""
+        self.assertRaises(
+            ValueError,
+            datastore.DatapackageDescriptor,
+            {"resources": "not-a-list"},
+            dataset="epacems",
+            doi="123")
+
     def test_json_string_representation(self):
         """Checks that json representation parses to the same dict."""
         self.assertEqual(
             self.MOCK_DATAPACKAGE,
             json.loads(self.descriptor.get_json_string()))
 
+    def test_json_bytes_returns_raw_json(self):
+        """When raw json is given, get_json_bytes() returns it unchanged."""
+        raw_json = json.dumps(self.MOCK_DATAPACKAGE).encode("utf-8")
+        desc = datastore.DatapackageDescriptor(
+            self.MOCK_DATAPACKAGE,
+            dataset="epacems",
+            doi="123",
+            raw_json=raw_json)
+        self.assertEqual(raw_json, desc.get_json_bytes())
+
 
 class MockableZenodoFetcher(datastore.ZenodoFetcher):
     """Test friendly version of ZenodoFetcher.
@@ -171,6 +205,25 @@ class TestZenodoFetcher(unittest.TestCase):
         self.assertEqual(self.MOCK_EPACEMS_DATAPACKAGE, desc.datapackage_json)
         # self.assertTrue(responses.assert_call_count("http://localhost/my/datapackage.json", 1))
 
+    @responses.activate
+    def test_get_descriptor_uses_cache(self):
+        """Descriptors are stored in the cache and later retrieved without http calls."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = resource_cache.LocalFileCache(Path(cache_dir))
+        responses.add(responses.GET,
+                      f"https://zenodo.org/api/deposit/depositions/{self.PROD_EPACEMS_ZEN_ID}",
+                      json=self.MOCK_EPACEMS_DEPOSITION)
+        responses.add(responses.GET,
+                      "http://localhost/my/datapackage.json",
+                      json=self.MOCK_EPACEMS_DATAPACKAGE)
+        datastore.ZenodoFetcher(cache=cache).get_descriptor("epacems")
+        self.assertEqual(2, len(responses.calls))
+
+        desc = datastore.ZenodoFetcher(cache=cache).get_descriptor("epacems")
+        self.assertEqual(self.MOCK_EPACEMS_DATAPACKAGE, desc.datapackage_json)
+        self.assertEqual(2, len(responses.calls))
+
     def test_get_resource_key(self):
         """Tests normal operation of get_resource_key()."""
         self.assertEqual(
@@ -201,10 +254,142 @@ class TestZenodoFetcher(unittest.TestCase):
         res = PudlResourceKey("epacems", self.PROD_EPACEMS_DOI, "first")
         self.assertRaises(datastore.ChecksumMismatch, self.fetcher.get_resource, res)
 
+    @responses.activate
+    def test_iter_resource(self):
+        """Tests that iter_resource() gives back the content of the resource."""
+        responses.add(responses.GET,
+                      "http://localhost/first", body="blah")
+        res = PudlResourceKey("epacems", self.PROD_EPACEMS_DOI, "first")
+        self.assertEqual(b"blah", b"".join(self.fetcher.iter_resource(res)))
+
+    @responses.activate
+    def test_iter_resource_with_invalid_checksum(self):
+        """Streaming resource where content does not match the checksum throws ChecksumMismatch."""
+        responses.add(responses.GET,
+                      "http://localhost/first", body="wrongContent")
+        res = PudlResourceKey("epacems", self.PROD_EPACEMS_DOI, "first")
+        self.assertRaises(
+            datastore.ChecksumMismatch, list, self.fetcher.iter_resource(res))
+
     def test_get_resource_with_nonexistent_resource_fails(self):
         """If resource does not exist, get_resource() throws KeyError."""
         res = PudlResourceKey("epacems", self.PROD_EPACEMS_DOI, "nonexistent")
         self.assertRaises(KeyError, self.fetcher.get_resource, res)
 
 
-# TODO(rousik): add unit tests for Datasource class as well
+class TestDatastore(unittest.TestCase):
+    """Unit tests for the Datastore class."""
+
+    PROD_EPACEMS_DOI = "10.5281/zenodo.4127055"
+    PROD_EPACEMS_ZEN_ID = 4127055
+    CONTENTS = {
+        "first": b"firstContent",
+        "second": b"secondContent",
+        "third": b"thirdContent",
+        "fourth": b"fourthContent",
+        "archive.zip": make_zip(member=b"memberContent"),
+    }
+
+    def setUp(self):
+        """Prepares temporary directory for the local cache."""
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.cache = resource_cache.LocalFileCache(Path(self.test_dir))
+
+    def add_zenodo_responses(self):
+        """Registers mock zenodo responses for the epacems datapackage and resources."""
+        datapackage = {"resources": [
+            {"name": name,
+             "path": f"http://localhost/{name}",
+             "hash": hashlib.md5(content).hexdigest()}  # nosec
+            for name, content in self.CONTENTS.items()
+        ]}
+        responses.add(responses.GET,
+                      f"https://zenodo.org/api/deposit/depositions/{self.PROD_EPACEMS_ZEN_ID}",
+                      json={"files": [{
+                          "filename": "datapackage.json",
+                          "links": {"download": "http://localhost/datapackage.json"}}]})
+        responses.add(responses.GET,
+                      "http://localhost/datapackage.json",
+                      json=datapackage)
+        for name, content in self.CONTENTS.items():
+            responses.add(responses.GET, f"http://localhost/{name}", body=content)
+
+    def res(self, name: str) -> PudlResourceKey:
+        """Returns PudlResourceKey for named epacems resource."""
+        return PudlResourceKey("epacems", self.PROD_EPACEMS_DOI, name)
+
+    @responses.activate
+    def test_get_resources_downloads_missing_resources(self):
+        """Missing resources are downloaded, returned and stored in the local cache."""
+        self.add_zenodo_responses()
+        ds = datastore.Datastore(
+            local_cache_path=Path(self.test_dir), max_parallel_downloads=2)
+        self.assertEqual(
+            {self.res(name): content for name, content in self.CONTENTS.items()},
+            dict(ds.get_resources("epacems")))
+        for name, content in self.CONTENTS.items():
+            self.assertEqual(content, self.cache.get(self.res(name)))
+
+    @responses.activate
+    def test_get_resources_without_cache(self):
+        """Without any cache, downloaded resources are returned directly."""
+        self.add_zenodo_responses()
+        ds = datastore.Datastore(max_parallel_downloads=2)
+        self.assertEqual(
+            {self.res(name): content for name, content in self.CONTENTS.items()},
+            dict(ds.get_resources("epacems")))
+
+    @responses.activate
+    def test_corrupted_cached_resource_is_downloaded_again(self):
+        """Cached resource with invalid checksum is removed from cache and re-fetched."""
+        self.add_zenodo_responses()
+        ds = datastore.Datastore(local_cache_path=Path(self.test_dir))
+        res = self.res("first")
+        self.cache.add(res, b"corruptedContent")
+
+        self.assertEqual(
+            [(res, b"firstContent")], list(ds.get_resources("epacems", name="first")))
+        self.assertEqual(b"firstContent", self.cache.get(res))
+        self.assertTrue(
+            any(call.request.url.startswith("http://localhost/first")
+                for call in responses.calls))
+
+    @responses.activate
+    def test_corrupted_cached_resource_is_skipped_when_cached_only(self):
+        """With cached_only=True, cached resource with invalid checksum is removed and skipped."""
+        self.add_zenodo_responses()
+        ds = datastore.Datastore(local_cache_path=Path(self.test_dir))
+        res = self.res("first")
+        self.cache.add(res, b"corruptedContent")
+
+        self.assertEqual(
+            [], list(ds.get_resources("epacems", cached_only=True, name="first")))
+        self.assertFalse(self.cache.contains(res))
+
+    @responses.activate
+    def test_get_zipfile_resource_reads_local_file(self):
+        """Valid zip archive in the local cache is opened directly from disk."""
+        self.add_zenodo_responses()
+        ds = datastore.Datastore(local_cache_path=Path(self.test_dir))
+        res = self.res("archive.zip")
+        self.cache.add(res, self.CONTENTS["archive.zip"])
+
+        zf = ds.get_zipfile_resource("epacems", name="archive.zip")
+        self.assertEqual(str(self.cache.get_path(res)), zf.filename)
+        self.assertEqual(b"memberContent", zf.read("member"))
+        self.assertFalse(
+            any(call.request.url.startswith("http://localhost/archive.zip")
+                for call in responses.calls))
+
+    @responses.activate
+    def test_get_zipfile_resource_with_corrupted_local_file(self):
+        """Truncated zip archive in the local cache is removed and downloaded again."""
+        self.add_zenodo_responses()
+        ds = datastore.Datastore(local_cache_path=Path(self.test_dir))
+        res = self.res("archive.zip")
+        self.cache.add(res, self.CONTENTS["archive.zip"][:-10])
+
+        zf = ds.get_zipfile_resource("epacems", name="archive.zip")
+        self.assertEqual(b"memberContent", zf.read("member"))
+        self.assertEqual(self.CONTENTS["archive.zip"], self.cache.get(res))
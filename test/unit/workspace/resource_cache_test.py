@@ -28,6 +28,54 @@ class TestLocalFileCache(unittest.TestCase):
         self.assertTrue(self.cache.contains(res))
         self.assertEqual(b"blah", self.cache.get(res))
 
+    def test_try_get(self):
+        """try_get() returns None for missing resources and content of present ones."""
+        res = PudlResourceKey("ds", "doi", "file.txt")
+        self.assertIsNone(self.cache.try_get(res))
+        self.cache.add(res, b"blah")
+        self.assertEqual(b"blah", self.cache.try_get(res))
+
+    def test_add_stream(self):
+        """Adding resource in chunks stores the concatenated content."""
+        res = PudlResourceKey("ds", "doi", "file.txt")
+        self.cache.add_stream(res, iter([b"bl", b"ah"]))
+        self.assertTrue(self.cache.contains(res))
+        self.assertEqual(b"blah", self.cache.get(res))
+
+    def test_add_stream_file_mode_matches_add(self):
+        """Files written by add_stream() get the same permissions as those from add()."""
+        res_add = PudlResourceKey("ds", "doi", "added.txt")
+        res_stream = PudlResourceKey("ds", "doi", "streamed.txt")
+        self.cache.add(res_add, b"blah")
+        self.cache.add_stream(res_stream, iter([b"blah"]))
+        self.assertEqual(
+            self.cache.get_path(res_add).stat().st_mode,
+            self.cache.get_path(res_stream).stat().st_mode)
+
+    def test_add_stream_with_size_hint(self):
+        """Content is stored correctly even when size_hint is larger than the content."""
+        res = PudlResourceKey("ds", "doi", "file.txt")
+        self.cache.add_stream(res, iter([b"bl", b"ah"]), size_hint=1000)
+        self.assertEqual(b"blah", self.cache.get(res))
+
+    def test_add_stream_failure_leaves_no_partial_file(self):
+        """When chunks can't be fully retrieved, nothing is stored in the cache."""
+        res = PudlResourceKey("ds", "doi", "file.txt")
+
+        def broken_chunks():
+            yield b"bl"
+            raise ValueError("download failed")
+
+        self.assertRaises(ValueError, self.cache.add_stream, res, broken_chunks())
+        self.assertFalse(self.cache.contains(res))
+        self.assertEqual([], list((Path(self.test_dir) / "ds" / "doi").iterdir()))
+
+    def test_get_path(self):
+        """get_path() points to the file that holds the content of the resource."""
+        res = PudlResourceKey("ds", "doi", "file.txt")
+        self.cache.add(res, b"blah")
+        self.assertEqual(b"blah", self.cache.get_path(res).read_bytes())
+
     def test_that_two_cache_objects_share_storage(self):
         """Two LocalFileCache instances with the same path share the object storage."""
         second_cache = resource_cache.LocalFileCache(Path(self.test_dir))
@@ -67,6 +115,42 @@ class TestLocalFileCache(unittest.TestCase):
         self.assertTrue(ro_cache.contains(res))
 
 
+class TestAsyncWriteCache(unittest.TestCase):
+    """Unit tests for the AsyncWriteCache class."""
+
+    def setUp(self):
+        """Prepares AsyncWriteCache wrapping LocalFileCache in a temporary directory."""
+        self.test_dir = tempfile.mkdtemp()
+        self.local_cache = resource_cache.LocalFileCache(Path(self.test_dir))
+        self.cache = resource_cache.AsyncWriteCache(self.local_cache)
+
+    def tearDown(self):
+        """Deletes content of the temporary directories."""
+        shutil.rmtree(self.test_dir)
+
+    def test_added_resource_is_visible(self):
+        """Resource is visible right after add() and is stored in the wrapped cache."""
+        res = PudlResourceKey("ds", "doi", "file.txt")
+        self.cache.add(res, b"blah")
+        self.assertTrue(self.cache.contains(res))
+        self.assertEqual(b"blah", self.cache.get(res))
+        self.cache.flush()
+        self.assertEqual(b"blah", self.local_cache.get(res))
+
+    def test_flush_raises_write_errors(self):
+        """Errors encountered by background writes are raised from flush()."""
+        class FailingCache(resource_cache.LocalFileCache):
+            """LocalFileCache whose writes always fail."""
+
+            def add(self, resource, content):
+                """Throws IOError."""
+                raise IOError("disk is full")
+
+        cache = resource_cache.AsyncWriteCache(FailingCache(Path(self.test_dir)))
+        cache.add(PudlResourceKey("ds", "doi", "file.txt"), b"blah")
+        self.assertRaises(IOError, cache.flush)
+
+
 class TestLayeredCache(unittest.TestCase):
     """Unit tests for LayeredCache class."""
 